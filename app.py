@@ -1,9 +1,22 @@
+import hashlib
+import heapq
+import json
 import logging
+import os
+import pickle
+import queue
+import random
 import re
+import sqlite3
+import tempfile
+import threading
+import time
 
-from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 
 import gradio as gr
+import openpyxl
 import pandas as pd
 
 from google import genai
@@ -24,6 +37,30 @@ GEMINI_PROMPT_PREFIX = "Split the following rows of Names and Addresses into col
     "Convert Names, Care of Names and Addresses to Proper Case if necessary."
 GEMINI_MAX_RESPONDENT_COUNT = 50
 GEMINI_MAX_THREAD_COUNT = 10
+GEMINI_FALLBACK_MODEL_NAME = ""
+GEMINI_REQUEST_TIMEOUT = 120
+GEMINI_MAX_ATTEMPT_COUNT = 3
+GEMINI_MAX_REQUEST_THREAD_COUNT = GEMINI_MAX_THREAD_COUNT * 4
+GEMINI_RETRY_BACKOFF = 2
+GEMINI_HEDGE_ENABLED = True
+GEMINI_HEDGE_PERCENTILE = 95
+GEMINI_HEDGE_MIN_LATENCY_COUNT = 10
+GEMINI_HEDGE_LATENCY_WINDOW = 1000
+GEMINI_HEDGE_WARMUP_POLL_INTERVAL = 0.1
+GEMINI_STREAM_ENABLED = False
+GEMINI_STREAM_CHUNK_SIZE = 64
+GEMINI_FAKE_BACKEND = False
+GEMINI_FAKE_LATENCY_RANGE = (2, 6)
+GEMINI_FAKE_STALL_PROBABILITY = 0.05
+GEMINI_FAKE_STALL_LATENCY = 60
+GEMINI_FAKE_TRUNCATION_PROBABILITY = 0.05
+CACHE_DIRECTORY_PATH = "cache"
+CACHE_QUERY_PARAMETER_COUNT = 500
+CACHE_VERSION = 3
+EXCEL_CHUNKED_MODE = False
+EXCEL_CHUNK_ROW_COUNT = 5000
+EXCEL_PREVIEW_ROW_COUNT = 100
+EXCEL_PREVIEW_UPDATE_INTERVAL = 1
 
 
 logging.basicConfig(
@@ -31,6 +68,9 @@ logging.basicConfig(
     level=logging.INFO
 )
 
+gemini_request_latencies = deque(maxlen=GEMINI_HEDGE_LATENCY_WINDOW)
+gemini_request_latencies_lock = threading.Lock()
+
 
 class Respondent(BaseModel):
     name: str
@@ -74,7 +114,7 @@ def original_excel_file_uploaded(original_excel_file_path):
         value=excel_sheet_names[0]
     )
 
-    original_excel_data_frame = excel_file.parse(excel_sheet_names[0])
+    original_excel_data_frame = excel_file.parse(excel_sheet_names[0], nrows=EXCEL_PREVIEW_ROW_COUNT if EXCEL_CHUNKED_MODE else None)
     original_excel_data_frame = original_excel_data_frame.map(lambda x: str_trim_and_none(x))
     original_excel_data_frame.dropna(how="all", inplace=True)
     original_excel_data_frame.fillna("", inplace=True)
@@ -138,7 +178,7 @@ def original_excel_sheet_name_dropdown_changed(original_excel_file_path, origina
 
     excel_file = pd.ExcelFile(original_excel_file_path)
 
-    original_excel_data_frame = excel_file.parse(original_excel_sheet_name)
+    original_excel_data_frame = excel_file.parse(original_excel_sheet_name, nrows=EXCEL_PREVIEW_ROW_COUNT if EXCEL_CHUNKED_MODE else None)
     original_excel_data_frame = original_excel_data_frame.map(lambda x: str_trim_and_none(x))
     original_excel_data_frame.dropna(how="all", inplace=True)
     original_excel_data_frame.fillna("", inplace=True)
@@ -239,47 +279,757 @@ def address_header_dropdown_changed(original_excel_data_frame, address_header):
     return address_header_dropdowns
 
 
-def gemini_process_respondents(gemini_prompt):
+def get_gemini_prompt(gemini_respondent_strings):
+    gemini_prompt = f"{GEMINI_PROMPT_PREFIX}\n"
+
+    for respondent_string in gemini_respondent_strings:
+        gemini_prompt += f"\n{respondent_string}"
+
+    return gemini_prompt
+
+
+def get_percentile(values, percentile):
+    sorted_values = sorted(values)
+
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * percentile / 100))]
+
+
+def fake_gemini_sleep():
+    if random.random() < GEMINI_FAKE_STALL_PROBABILITY:
+        time.sleep(GEMINI_FAKE_STALL_LATENCY)
+    else:
+        time.sleep(random.uniform(*GEMINI_FAKE_LATENCY_RANGE))
+
+
+def fake_gemini_get_respondents(gemini_respondent_strings):
+    respondents = []
+
+    for respondent_string in gemini_respondent_strings:
+        name, _, address = respondent_string.partition(", ")
+
+        respondents.append(Respondent(
+            name=name,
+            address_line_1=address,
+            address_line_2="",
+            address_line_3="",
+            district="",
+            state="",
+            pin_code=""
+        ))
+
+    return respondents
+
+
+def fake_gemini_process_respondents(gemini_respondent_strings):
+    fake_gemini_sleep()
+
+    return fake_gemini_get_respondents(gemini_respondent_strings)
+
+
+def fake_gemini_stream_respondents(gemini_respondent_strings):
+    fake_gemini_sleep()
+
+    gemini_output_text = RespondentList(respondents=fake_gemini_get_respondents(gemini_respondent_strings)).model_dump_json()
+
+    if random.random() < GEMINI_FAKE_TRUNCATION_PROBABILITY:
+        gemini_output_text = gemini_output_text[:random.randrange(len(gemini_output_text))]
+
+    for i in range(0, len(gemini_output_text), GEMINI_STREAM_CHUNK_SIZE):
+        time.sleep(random.uniform(*GEMINI_FAKE_LATENCY_RANGE) * GEMINI_STREAM_CHUNK_SIZE / len(gemini_output_text))
+
+        yield gemini_output_text[i:i + GEMINI_STREAM_CHUNK_SIZE]
+
+
+def parse_streamed_respondents(gemini_output_texts):
+    buffer = ""
+    position = 0
+    depth = 0
+    closed = False
+    in_string = False
+    escaped = False
+    respondent_start = None
+
+    for gemini_output_text in gemini_output_texts:
+        buffer += gemini_output_text
+
+        while position < len(buffer):
+            character = buffer[position]
+
+            if in_string:
+                if escaped:
+                    escaped = False
+                elif character == "\\":
+                    escaped = True
+                elif character == '"':
+                    in_string = False
+            elif character == '"':
+                in_string = True
+            elif character == "{" or character == "[":
+                depth += 1
+
+                # {"respondents": [{...}, {...}]}: each respondent object opens at depth 3
+                if depth == 3 and character == "{":
+                    respondent_start = position
+            elif character == "}" or character == "]":
+                if depth == 3 and character == "}" and respondent_start is not None:
+                    yield Respondent.model_validate_json(buffer[respondent_start:position + 1])
+
+                    respondent_start = None
+
+                depth -= 1
+
+                if depth == 0:
+                    closed = True
+
+            position += 1
+
+        if respondent_start is None:
+            buffer = ""
+            position = 0
+        else:
+            buffer = buffer[respondent_start:]
+            position -= respondent_start
+            respondent_start = 0
+
+    # A stream that stops before the top-level object closes was truncated, so only its missing tail needs to be retried
+    return closed
+
+
+def gemini_stream_respondents(gemini_respondent_strings, gemini_model_name):
+    if GEMINI_FAKE_BACKEND:
+        return (yield from parse_streamed_respondents(fake_gemini_stream_respondents(gemini_respondent_strings)))
+
+    gemini_prompt = get_gemini_prompt(gemini_respondent_strings)
+
     if DEBUG:
         logging.info(f"gemini_prompt: {gemini_prompt}")
 
+    gemini_client = genai.Client(
+        http_options={
+            "timeout": GEMINI_REQUEST_TIMEOUT * 1000
+        }
+    )
+
+    gemini_output_chunks = gemini_client.models.generate_content_stream(
+        model=gemini_model_name,
+        contents=gemini_prompt,
+        config={
+            "response_mime_type": "application/json",
+            "response_json_schema": RespondentList.model_json_schema()
+        }
+    )
+
+    return (yield from parse_streamed_respondents(gemini_output_chunk.text or "" for gemini_output_chunk in gemini_output_chunks))
+
+
+def gemini_stream_batch_respondents(gemini_respondent_strings, gemini_model_name, batch_state):
+    with batch_state["lock"]:
+        position = len(batch_state["respondents"])
+
+    gemini_respondent_stream = gemini_stream_respondents(gemini_respondent_strings[position:], gemini_model_name)
+
+    closed = False
+
+    # Only the respondents this request added can be wrong when its count turns out wrong, so only those are rolled back
+    added_position = None
+
     try:
-        gemini_client = genai.Client()
-
-        gemini_output = gemini_client.models.generate_content(
-            model=GEMINI_MODEL_NAME,
-            contents=gemini_prompt,
-            config={
-                "response_mime_type": "application/json",
-                "response_json_schema": RespondentList.model_json_schema()
-            }
-        )
+        while True:
+            try:
+                respondent = next(gemini_respondent_stream)
+            except StopIteration as e:
+                closed = e.value
 
-        if DEBUG:
-            logging.info(f"gemini_output: {gemini_output.text}")
+                break
 
-        return RespondentList.model_validate_json(gemini_output.text).respondents
+            with batch_state["lock"]:
+                if batch_state["finished"]:
+                    return None
+
+                # A hedge streams the same tail, so keep whichever copy of each respondent arrives first
+                if position == len(batch_state["respondents"]) and position < len(gemini_respondent_strings):
+                    if added_position is None:
+                        added_position = position
+
+                    batch_state["respondents"].append(respondent)
+                    batch_state["model_names"].append(gemini_model_name)
+                    batch_state["respondent_queue"].put((batch_state["batch_index"], position, respondent))
+
+            position += 1
     except Exception as e:
         logging.error(e)
 
+    with batch_state["lock"]:
+        if batch_state["finished"]:
+            return None
 
-def process_button_clicked(original_excel_file_path, original_excel_data_frame, arbitrator_name_header, arbitrator_address_header, arbitrator_phone_header, arbitrator_email_header, respondent_count, *inputs):
-    if original_excel_file_path is None or original_excel_data_frame is None or respondent_count is None:
-        return [None, None]
+        # A complete response with the wrong number of respondents cannot be matched to rows, so everything it added is discarded
+        if (closed and position != len(gemini_respondent_strings)) or position > len(gemini_respondent_strings):
+            logging.warning(f"gemini stream returned {position} of {len(gemini_respondent_strings)} respondents, discarding its respondents")
+
+            if added_position is not None:
+                del batch_state["respondents"][added_position:]
+                del batch_state["model_names"][added_position:]
+
+            return None
+
+        # A complete batch is finished right away, so a request that ends later cannot roll back what is returned
+        if len(batch_state["respondents"]) == len(gemini_respondent_strings):
+            batch_state["finished"] = True
+
+            return list(batch_state["respondents"])
+
+        logging.warning(f"gemini stream stopped after {len(batch_state['respondents'])} of {len(gemini_respondent_strings)} respondents, the rest will be retried")
+
+    return None
+
+
+def gemini_process_respondents(gemini_respondent_strings, gemini_model_name=GEMINI_MODEL_NAME):
+    gemini_prompt = get_gemini_prompt(gemini_respondent_strings)
+
+    if DEBUG:
+        logging.info(f"gemini_prompt: {gemini_prompt}")
+
+    try:
+        if GEMINI_FAKE_BACKEND:
+            gemini_respondents = fake_gemini_process_respondents(gemini_respondent_strings)
+        else:
+            gemini_client = genai.Client(
+                http_options={
+                    "timeout": GEMINI_REQUEST_TIMEOUT * 1000
+                }
+            )
+
+            gemini_output = gemini_client.models.generate_content(
+                model=gemini_model_name,
+                contents=gemini_prompt,
+                config={
+                    "response_mime_type": "application/json",
+                    "response_json_schema": RespondentList.model_json_schema()
+                }
+            )
+
+            if DEBUG:
+                logging.info(f"gemini_output: {gemini_output.text}")
+
+            gemini_respondents = RespondentList.model_validate_json(gemini_output.text).respondents
+
+        # Respondents are matched to rows by position, so a response with the wrong number of respondents is retried like a failed one
+        if len(gemini_respondents) != len(gemini_respondent_strings):
+            logging.warning(f"gemini returned {len(gemini_respondents)} of {len(gemini_respondent_strings)} respondents, discarding the response")
+
+            return None
+
+        return gemini_respondents
+    except Exception as e:
+        logging.error(e)
+
+
+def gemini_request_timed(request_function, request_arguments):
+    start_time = time.monotonic()
+
+    gemini_output = request_function(*request_arguments)
+
+    return gemini_output, time.monotonic() - start_time
+
+
+def submit_gemini_request(request_executor, running_request_futures, request_function, request_arguments):
+    request_future = request_executor.submit(gemini_request_timed, request_function, request_arguments)
+
+    # Requests that lost a hedge or missed their deadline keep their worker until they return, so they are tracked until done
+    running_request_futures.add(request_future)
+    request_future.add_done_callback(running_request_futures.discard)
+
+    return request_future
+
+
+def get_gemini_hedge_delay():
+    with gemini_request_latencies_lock:
+        request_latencies = list(gemini_request_latencies)
+
+    if len(request_latencies) < GEMINI_HEDGE_MIN_LATENCY_COUNT:
+        return None
+
+    return get_percentile(request_latencies, GEMINI_HEDGE_PERCENTILE)
+
+
+def gemini_process_respondents_hedged(request_function, request_arguments, request_executor, running_request_futures):
+    start_time = time.monotonic()
+    deadline_time = start_time + GEMINI_REQUEST_TIMEOUT
+
+    hedge_delay = get_gemini_hedge_delay() if GEMINI_HEDGE_ENABLED else None
+
+    request_future = submit_gemini_request(request_executor, running_request_futures, request_function, request_arguments)
+
+    request_futures = {request_future}
+
+    hedged = False
+
+    while len(request_futures) > 0:
+        if hedged or not GEMINI_HEDGE_ENABLED:
+            wait_time = deadline_time
+        elif hedge_delay is None:
+            # Requests that start before the window is warm wake up until it is, so they can still be hedged
+            wait_time = min(time.monotonic() + GEMINI_HEDGE_WARMUP_POLL_INTERVAL, deadline_time)
+        else:
+            wait_time = min(start_time + hedge_delay, deadline_time)
+
+        timeout = wait_time - time.monotonic()
+
+        done_futures, request_futures = wait(request_futures, timeout=max(timeout, 0), return_when=FIRST_COMPLETED)
+
+        for done_future in done_futures:
+            gemini_output, request_latency = done_future.result()
 
+            if gemini_output is not None:
+                with gemini_request_latencies_lock:
+                    gemini_request_latencies.append(request_latency)
+
+                return gemini_output
+
+        if time.monotonic() >= deadline_time:
+            logging.warning(f"gemini request missed its {GEMINI_REQUEST_TIMEOUT}s deadline")
+
+            break
+
+        if GEMINI_HEDGE_ENABLED and hedge_delay is None:
+            hedge_delay = get_gemini_hedge_delay()
+
+        if not hedged and hedge_delay is not None and len(request_futures) > 0 and time.monotonic() >= start_time + hedge_delay:
+            hedged = True
+
+            # A hedge that has to wait for a free worker would only add load, so skip it when every worker is busy
+            if len(running_request_futures) >= GEMINI_MAX_REQUEST_THREAD_COUNT:
+                continue
+
+            if DEBUG:
+                logging.info(f"hedging gemini request after {hedge_delay:.2f}s")
+
+            request_futures.add(submit_gemini_request(request_executor, running_request_futures, request_function, request_arguments))
+
+    return None
+
+
+def gemini_process_batch(batch_index, gemini_respondent_strings, request_executor, running_request_futures, respondent_queue, batch_latencies):
+    start_time = time.monotonic()
+
+    # Streamed respondents are kept across hedges and attempts, so every retry only asks for the missing tail
+    batch_state = {
+        "batch_index": batch_index,
+        "respondents": [],
+        "model_names": [],
+        "respondent_queue": respondent_queue,
+        "lock": threading.Lock(),
+        "finished": False
+    }
+
+    gemini_model_names = [GEMINI_MODEL_NAME] * GEMINI_MAX_ATTEMPT_COUNT
+
+    if GEMINI_FALLBACK_MODEL_NAME != "":
+        gemini_model_names.append(GEMINI_FALLBACK_MODEL_NAME)
+
+    gemini_output = None
+    gemini_output_model_names = None
+
+    try:
+        for attempt, gemini_model_name in enumerate(gemini_model_names):
+            if attempt > 0:
+                logging.warning(f"retrying gemini batch with {gemini_model_name} (attempt {attempt + 1})")
+
+                # Back off exponentially with full jitter so that retries do not pile onto a rate-limited or overloaded API
+                time.sleep(random.uniform(0, GEMINI_RETRY_BACKOFF * 2 ** (attempt - 1)))
+
+            if GEMINI_STREAM_ENABLED:
+                gemini_output = gemini_process_respondents_hedged(gemini_stream_batch_respondents, (gemini_respondent_strings, gemini_model_name, batch_state), request_executor, running_request_futures)
+            else:
+                gemini_output = gemini_process_respondents_hedged(gemini_process_respondents, (gemini_respondent_strings, gemini_model_name), request_executor, running_request_futures)
+
+            if gemini_output is not None:
+                gemini_output_model_names = [gemini_model_name] * len(gemini_output)
+
+                break
+
+        with batch_state["lock"]:
+            batch_state["finished"] = True
+
+            # Streamed respondents can come from different attempts and models, so take the model of each one from the batch state
+            if GEMINI_STREAM_ENABLED:
+                gemini_output_model_names = list(batch_state["model_names"])
+
+            # Streamed respondents are matched to rows by position, so the ones received before the attempts ran out are kept
+            if gemini_output is None and len(batch_state["respondents"]) > 0:
+                gemini_output = list(batch_state["respondents"])
+
+        if not GEMINI_STREAM_ENABLED and gemini_output is not None:
+            for position, respondent in enumerate(gemini_output):
+                respondent_queue.put((batch_index, position, respondent))
+    finally:
+        respondent_queue.put((batch_index, None, None))
+
+    batch_latencies.append(time.monotonic() - start_time)
+
+    return gemini_output, gemini_output_model_names
+
+
+def gemini_iter_respondents(gemini_batches, batch_latencies):
+    start_time = time.monotonic()
+
+    request_executor = ThreadPoolExecutor(max_workers=GEMINI_MAX_REQUEST_THREAD_COUNT)
+
+    running_request_futures = set()
+
+    respondent_queue = queue.Queue()
+
+    gemini_outputs = []
+    gemini_output_model_names = []
+
+    with ThreadPoolExecutor(max_workers=GEMINI_MAX_THREAD_COUNT) as executor:
+        batch_futures = []
+
+        for batch_index, gemini_batch in enumerate(gemini_batches):
+            batch_futures.append(executor.submit(gemini_process_batch, batch_index, gemini_batch, request_executor, running_request_futures, respondent_queue, batch_latencies))
+
+        # Hand every respondent to the caller as soon as it arrives, until every batch has finished
+        finished_batch_count = 0
+        respondent_count = 0
+
+        while finished_batch_count < len(gemini_batches):
+            batch_index, position, respondent = respondent_queue.get()
+
+            if position is None:
+                finished_batch_count += 1
+
+                continue
+
+            if DEBUG and respondent_count == 0:
+                logging.info(f"first respondent after {time.monotonic() - start_time:.2f}s")
+
+            respondent_count += 1
+
+            yield batch_index, position, respondent
+
+        for batch_future in batch_futures:
+            gemini_output, gemini_model_names = batch_future.result()
+
+            gemini_outputs.append(gemini_output)
+            gemini_output_model_names.append(gemini_model_names)
+
+    request_executor.shutdown(wait=False, cancel_futures=True)
+
+    if len(batch_latencies) > 0:
+        logging.info(f"batch latency: p50 {get_percentile(batch_latencies, 50):.2f}s, p95 {get_percentile(batch_latencies, 95):.2f}s, p99 {get_percentile(batch_latencies, 99):.2f}s")
+
+    return gemini_outputs, gemini_output_model_names
+
+
+def gemini_process_batches(gemini_batches, batch_latencies):
+    gemini_respondents = gemini_iter_respondents(gemini_batches, batch_latencies)
+
+    while True:
+        try:
+            next(gemini_respondents)
+        except StopIteration as e:
+            return e.value
+
+
+def get_row_fingerprint(row, respondent_headers, gemini_model_name=GEMINI_MODEL_NAME):
+    row_values = [gemini_model_name, GEMINI_PROMPT_PREFIX]
+
+    for name_header, address_headers in respondent_headers:
+        row_values.append([
+            str(row.loc[name_header]).strip(),
+            [str(row.loc[address_header]).strip() for address_header in address_headers]
+        ])
+
+    return hashlib.sha256(json.dumps(row_values, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+def get_cache_file_path(original_excel_file_path):
+    original_excel_file_name = os.path.splitext(os.path.basename(original_excel_file_path.name))[0]
+
+    return os.path.join(CACHE_DIRECTORY_PATH, f"{original_excel_file_name}.sqlite3")
+
+
+def open_cache(original_excel_file_path, original_excel_sheet_name):
+    os.makedirs(CACHE_DIRECTORY_PATH, exist_ok=True)
+
+    cache_connection = sqlite3.connect(get_cache_file_path(original_excel_file_path))
+
+    # Caches in an older layout cannot be matched to rows safely, so start them over
+    if cache_connection.execute("PRAGMA user_version").fetchone()[0] != CACHE_VERSION:
+        with cache_connection:
+            cache_connection.execute("DROP TABLE IF EXISTS cached_rows")
+            cache_connection.execute(f"PRAGMA user_version = {CACHE_VERSION}")
+
+    cache_connection.execute("CREATE TABLE IF NOT EXISTS cached_rows (sheet_name TEXT NOT NULL, fingerprint TEXT NOT NULL, generation INTEGER NOT NULL, respondents TEXT NOT NULL, PRIMARY KEY (sheet_name, fingerprint))")
+
+    cache_generation = cache_connection.execute("SELECT COALESCE(MAX(generation), 0) + 1 FROM cached_rows WHERE sheet_name = ?", (original_excel_sheet_name,)).fetchone()[0]
+
+    return {
+        "connection": cache_connection,
+        "sheet_name": original_excel_sheet_name,
+        "generation": cache_generation
+    }
+
+
+def close_cache(cache_state):
+    # Rows are only dropped once the whole sheet has been processed, so every chunk can still reuse the rows of the last run
+    try:
+        with cache_state["connection"]:
+            cache_state["connection"].execute("DELETE FROM cached_rows WHERE sheet_name = ? AND generation < ?", (cache_state["sheet_name"], cache_state["generation"]))
+    except Exception as e:
+        logging.error(e)
+
+    cache_state["connection"].close()
+
+
+def load_cached_rows(cache_state, row_fingerprints):
+    cached_respondents = {}
+
+    fingerprints = list(set(row_fingerprints.values()))
+
+    try:
+        with cache_state["connection"]:
+            for i in range(0, len(fingerprints), CACHE_QUERY_PARAMETER_COUNT):
+                query_fingerprints = fingerprints[i:i + CACHE_QUERY_PARAMETER_COUNT]
+
+                for fingerprint, respondents in cache_state["connection"].execute(f"SELECT fingerprint, respondents FROM cached_rows WHERE sheet_name = ? AND fingerprint IN ({', '.join('?' * len(query_fingerprints))})", [cache_state["sheet_name"], *query_fingerprints]):
+                    cached_respondents[fingerprint] = json.loads(respondents)
+
+                # Reused rows move to the current generation, so they are kept when the rows of the last run are dropped
+                cache_state["connection"].execute(f"UPDATE cached_rows SET generation = ? WHERE sheet_name = ? AND fingerprint IN ({', '.join('?' * len(query_fingerprints))})", [cache_state["generation"], cache_state["sheet_name"], *query_fingerprints])
+    except Exception as e:
+        logging.error(e)
+
+    return cached_respondents
+
+
+def save_cached_rows(cache_state, cached_rows):
+    try:
+        with cache_state["connection"]:
+            cache_state["connection"].executemany(
+                "INSERT OR REPLACE INTO cached_rows (sheet_name, fingerprint, generation, respondents) VALUES (?, ?, ?, ?)",
+                [(cache_state["sheet_name"], fingerprint, cache_state["generation"], json.dumps(respondents, ensure_ascii=False)) for fingerprint, respondents in cached_rows.items()]
+            )
+    except Exception as e:
+        logging.error(e)
+
+
+def get_respondent_headers(respondent_count, inputs):
     name_headers = inputs[0:MAX_RESPONDENT_COUNT]
     address_header_counts = inputs[MAX_RESPONDENT_COUNT:2 * MAX_RESPONDENT_COUNT]
     address_header_groups = inputs[2 * MAX_RESPONDENT_COUNT:]
 
-    respondent_strings = []
-    respondent_indexes = []
+    respondent_headers = []
 
     for i in range(respondent_count):
         name_header = name_headers[i]
         address_header_count = address_header_counts[i]
         address_headers = address_header_groups[i * MAX_ADDRESS_HEADER_COUNT:i * MAX_ADDRESS_HEADER_COUNT + address_header_count]
 
+        respondent_headers.append((name_header, address_headers))
+
+    return respondent_headers
+
+
+def get_other_headers(excel_column_headers, arbitrator_name_header, arbitrator_address_header, arbitrator_phone_header, arbitrator_email_header, respondent_headers):
+    other_headers = list(excel_column_headers)
+
+    if arbitrator_name_header != "" and arbitrator_name_header in other_headers:
+        other_headers.remove(arbitrator_name_header)
+
+    if arbitrator_address_header != "" and arbitrator_address_header in other_headers:
+        other_headers.remove(arbitrator_address_header)
+
+    if arbitrator_phone_header != "" and arbitrator_phone_header in other_headers:
+        other_headers.remove(arbitrator_phone_header)
+
+    if arbitrator_email_header != "" and arbitrator_email_header in other_headers:
+        other_headers.remove(arbitrator_email_header)
+
+    for name_header, address_headers in respondent_headers:
+        if name_header in other_headers:
+            other_headers.remove(name_header)
+
+        for address_header in address_headers:
+            if address_header in other_headers:
+                other_headers.remove(address_header)
+
+    return other_headers
+
+
+def get_respondent_output_headers(respondent_number):
+    return [
+        f"Respondent {respondent_number + 1} Name",
+        f"Respondent {respondent_number + 1} Address Line 1",
+        f"Respondent {respondent_number + 1} Address Line 2",
+        f"Respondent {respondent_number + 1} Address Line 3",
+        f"Respondent {respondent_number + 1} District",
+        f"Respondent {respondent_number + 1} State",
+        f"Respondent {respondent_number + 1} PIN Code"
+    ]
+
+
+def write_respondent(processed_excel_data_frame, respondent_index, respondent_object):
+    respondent_values = [
+        respondent_object.name,
+        respondent_object.address_line_1,
+        respondent_object.address_line_2,
+        respondent_object.address_line_3,
+        respondent_object.district,
+        respondent_object.state,
+        respondent_object.pin_code
+    ]
+
+    for respondent_output_header, respondent_value in zip(get_respondent_output_headers(respondent_index[1]), respondent_values):
+        processed_excel_data_frame.loc[respondent_index[0], respondent_output_header] = respondent_value
+
+
+def clear_respondent(processed_excel_data_frame, respondent_index):
+    for respondent_output_header in get_respondent_output_headers(respondent_index[1]):
+        if respondent_output_header in processed_excel_data_frame.columns:
+            processed_excel_data_frame.loc[respondent_index[0], respondent_output_header] = None
+
+
+def get_processed_excel_headers(excel_column_headers, arbitrator_name_header, arbitrator_address_header, arbitrator_phone_header, arbitrator_email_header, respondent_headers):
+    processed_excel_headers = []
+
+    if arbitrator_name_header != "":
+        processed_excel_headers.append("Arbitrator Name")
+
+    if arbitrator_address_header != "":
+        processed_excel_headers.append("Arbitrator Address")
+
+    if arbitrator_phone_header != "":
+        processed_excel_headers.append("Arbitrator Phone")
+
+    if arbitrator_email_header != "":
+        processed_excel_headers.append("Arbitrator Email")
+
+    processed_excel_headers.append("No. of Respondents")
+
+    for i in range(len(respondent_headers)):
+        processed_excel_headers += get_respondent_output_headers(i)
+
+    return processed_excel_headers + get_other_headers(excel_column_headers, arbitrator_name_header, arbitrator_address_header, arbitrator_phone_header, arbitrator_email_header, respondent_headers)
+
+
+def get_excel_column_headers(header_row):
+    excel_column_headers = []
+    excel_column_header_counts = {}
+
+    # Name headers the way pandas does, so they match the headers of the previewed data frame
+    for i, excel_column_header in enumerate(header_row):
+        if excel_column_header is None:
+            excel_column_header = f"Unnamed: {i}"
+
+        excel_column_header_count = excel_column_header_counts.get(excel_column_header, 0)
+
+        excel_column_header_counts[excel_column_header] = excel_column_header_count + 1
+
+        if excel_column_header_count > 0:
+            excel_column_header = f"{excel_column_header}.{excel_column_header_count}"
+
+        excel_column_headers.append(excel_column_header)
+
+    return excel_column_headers
+
+
+def read_excel_chunks(original_excel_file_path, original_excel_sheet_name):
+    # The read-only reader still keeps about 90 B for every row it has parsed, so the memory of the chunked mode grows slowly with the sheet instead of staying flat
+    workbook = openpyxl.load_workbook(original_excel_file_path.name, read_only=True, data_only=True)
+
+    try:
+        rows = workbook[original_excel_sheet_name].iter_rows(values_only=True)
+
+        excel_column_headers = get_excel_column_headers(next(rows, ()))
+
+        row_index = 0
+
+        chunk_rows = []
+
+        for row in rows:
+            row = row[:len(excel_column_headers)]
+
+            chunk_rows.append(row + (None,) * (len(excel_column_headers) - len(row)))
+
+            if len(chunk_rows) < EXCEL_CHUNK_ROW_COUNT:
+                continue
+
+            original_excel_data_frame = pd.DataFrame(chunk_rows, columns=excel_column_headers, index=range(row_index, row_index + len(chunk_rows)))
+            original_excel_data_frame = original_excel_data_frame.map(lambda x: str_trim_and_none(x))
+            original_excel_data_frame.dropna(how="all", inplace=True)
+            original_excel_data_frame.fillna("", inplace=True)
+
+            yield original_excel_data_frame
+
+            row_index += len(chunk_rows)
+
+            chunk_rows = []
+
+        if len(chunk_rows) > 0:
+            original_excel_data_frame = pd.DataFrame(chunk_rows, columns=excel_column_headers, index=range(row_index, row_index + len(chunk_rows)))
+            original_excel_data_frame = original_excel_data_frame.map(lambda x: str_trim_and_none(x))
+            original_excel_data_frame.dropna(how="all", inplace=True)
+            original_excel_data_frame.fillna("", inplace=True)
+
+            yield original_excel_data_frame
+    finally:
+        workbook.close()
+
+
+def read_run_file(run_file):
+    while True:
+        try:
+            yield pickle.load(run_file)
+        except EOFError:
+            return
+
+
+def get_preview_excel_data_frame(processed_excel_data_frame, processed_excel_headers):
+    preview_excel_data_frame = processed_excel_data_frame.head(EXCEL_PREVIEW_ROW_COUNT)
+
+    return preview_excel_data_frame[[processed_excel_header for processed_excel_header in processed_excel_headers if processed_excel_header in preview_excel_data_frame.columns]].fillna("")
+
+
+def process_data_frame(original_excel_data_frame, arbitrator_name_header, arbitrator_address_header, arbitrator_phone_header, arbitrator_email_header, respondent_headers, cache_state):
+    row_fingerprints = {}
+
+    for row_index, row in original_excel_data_frame.iterrows():
+        row_fingerprints[row_index] = get_row_fingerprint(row, respondent_headers)
+
+    cached_respondents = load_cached_rows(cache_state, row_fingerprints)
+
+    reused_row_indexes = set()
+
+    for row_index, row_fingerprint in row_fingerprints.items():
+        if row_fingerprint in cached_respondents:
+            reused_row_indexes.add(row_index)
+
+    # Rows are matched by content, so a new row and an edited row cannot be told apart and are both reprocessed
+    reprocessed_row_count = len(row_fingerprints) - len(reused_row_indexes)
+
+    logging.info(f"rows: {len(reused_row_indexes)} reused, {reprocessed_row_count} reprocessed")
+
+    respondent_strings = []
+    respondent_indexes = []
+
+    reused_respondent_objects = []
+    reused_respondent_indexes = []
+
+    for i in range(len(respondent_headers)):
+        name_header, address_headers = respondent_headers[i]
+
         for row_index, row in original_excel_data_frame.iterrows():
+            if row_index in reused_row_indexes:
+                cached_respondent = cached_respondents[row_fingerprints[row_index]].get(str(i))
+
+                if cached_respondent is not None:
+                    reused_respondent_objects.append(Respondent.model_validate(cached_respondent))
+                    reused_respondent_indexes.append((row_index, i))
+
+                continue
+
             name = str(row.loc[name_header]).strip()
 
             if name == "None" or name == "" or name == "-" or str.lower(name) == "na" or str.lower(name) == "n/a":
@@ -305,28 +1055,12 @@ def process_button_clicked(original_excel_file_path, original_excel_data_frame,
             respondent_strings.append(respondent_string)
             respondent_indexes.append((row_index, i))
 
-    gemini_prompts = []
+    gemini_batches = []
 
     for i in range(0, len(respondent_strings), GEMINI_MAX_RESPONDENT_COUNT):
-        gemini_prompt = f"{GEMINI_PROMPT_PREFIX}\n"
-
-        for respondent_string in respondent_strings[i:i + GEMINI_MAX_RESPONDENT_COUNT]:
-            gemini_prompt += f"\n{respondent_string}"
-
-        gemini_prompts.append(gemini_prompt)
-
-    gemini_outputs = []
+        gemini_batches.append(respondent_strings[i:i + GEMINI_MAX_RESPONDENT_COUNT])
 
-    with ThreadPoolExecutor(max_workers=GEMINI_MAX_THREAD_COUNT) as executor:
-        for gemini_output in executor.map(gemini_process_respondents, gemini_prompts):
-            gemini_outputs.append(gemini_output)
-
-    respondent_objects = []
-
-    for gemini_output in gemini_outputs:
-        respondent_objects += gemini_output
-
-    processed_excel_data_frame = pd.DataFrame()
+    processed_excel_data_frame = pd.DataFrame(index=original_excel_data_frame.index)
 
     if arbitrator_name_header != "":
         processed_excel_data_frame["Arbitrator Name"] = original_excel_data_frame[arbitrator_name_header]
@@ -344,6 +1078,98 @@ def process_button_clicked(original_excel_file_path, original_excel_data_frame,
 
         processed_excel_data_frame["Arbitrator Email"] = processed_excel_data_frame["Arbitrator Email"].map(lambda x: x.lower())
 
+    processed_excel_data_frame["No. of Respondents"] = 0
+
+    for respondent_index, respondent_object in zip(reused_respondent_indexes, reused_respondent_objects):
+        write_respondent(processed_excel_data_frame, respondent_index, respondent_object)
+
+    processed_excel_headers = get_processed_excel_headers(original_excel_data_frame.columns.tolist(), arbitrator_name_header, arbitrator_address_header, arbitrator_phone_header, arbitrator_email_header, respondent_headers)
+
+    yield [get_preview_excel_data_frame(processed_excel_data_frame, processed_excel_headers), None]
+
+    preview_time = time.monotonic()
+
+    gemini_respondents = gemini_iter_respondents(gemini_batches, [])
+
+    # Respondents are written and previewed as soon as they arrive, and the ones from failed batches are cleared again below
+    while True:
+        try:
+            batch_index, position, respondent_object = next(gemini_respondents)
+        except StopIteration as e:
+            gemini_outputs, gemini_output_model_names = e.value
+
+            break
+
+        write_respondent(processed_excel_data_frame, respondent_indexes[batch_index * GEMINI_MAX_RESPONDENT_COUNT + position], respondent_object)
+
+        if time.monotonic() - preview_time >= EXCEL_PREVIEW_UPDATE_INTERVAL:
+            yield [get_preview_excel_data_frame(processed_excel_data_frame, processed_excel_headers), None]
+
+            preview_time = time.monotonic()
+
+    processed_respondent_objects = []
+    processed_respondent_indexes = []
+
+    processed_row_model_names = {}
+
+    failed_row_indexes = set()
+
+    for i in range(len(gemini_batches)):
+        gemini_batch = gemini_batches[i]
+        gemini_output = gemini_outputs[i]
+        gemini_model_names = gemini_output_model_names[i]
+        gemini_batch_indexes = respondent_indexes[i * GEMINI_MAX_RESPONDENT_COUNT:i * GEMINI_MAX_RESPONDENT_COUNT + len(gemini_batch)]
+
+        if gemini_output is None:
+            gemini_output = []
+
+        # Respondents are matched to rows by position, so the rows of the missing tail are left out and retried next time
+        if len(gemini_output) < len(gemini_batch):
+            logging.warning(f"gemini batch {i + 1} returned {len(gemini_output)} of {len(gemini_batch)} respondents, skipping the rest")
+
+            for respondent_index in gemini_batch_indexes[len(gemini_output):]:
+                clear_respondent(processed_excel_data_frame, respondent_index)
+
+                failed_row_indexes.add(respondent_index[0])
+
+        processed_respondent_objects += gemini_output
+        processed_respondent_indexes += gemini_batch_indexes[:len(gemini_output)]
+
+        for respondent_index, gemini_model_name in zip(gemini_batch_indexes, gemini_model_names or []):
+            processed_row_model_names.setdefault(respondent_index[0], set()).add(gemini_model_name)
+
+    respondent_objects = reused_respondent_objects + processed_respondent_objects
+    respondent_indexes = reused_respondent_indexes + processed_respondent_indexes
+
+    cached_rows = {}
+    cached_row_fingerprints = {}
+
+    for row_index, row_fingerprint in row_fingerprints.items():
+        if row_index in failed_row_indexes or row_index in reused_row_indexes:
+            continue
+
+        row_model_names = processed_row_model_names.get(row_index, {GEMINI_MODEL_NAME})
+
+        # A row is cached under the model that processed it, so a row split across models has no fingerprint and is processed again next time
+        if len(row_model_names) > 1:
+            continue
+
+        row_model_name = next(iter(row_model_names))
+
+        if row_model_name != GEMINI_MODEL_NAME:
+            row_fingerprint = get_row_fingerprint(original_excel_data_frame.loc[row_index], respondent_headers, row_model_name)
+
+        cached_rows[row_fingerprint] = {}
+        cached_row_fingerprints[row_index] = row_fingerprint
+
+    for respondent_index, respondent_object in zip(respondent_indexes, respondent_objects):
+        if respondent_index[0] not in cached_row_fingerprints:
+            continue
+
+        cached_rows[cached_row_fingerprints[respondent_index[0]]][str(respondent_index[1])] = respondent_object.model_dump()
+
+    save_cached_rows(cache_state, cached_rows)
+
     respondent_number_dict = {}
 
     for respondent_index in respondent_indexes:
@@ -352,50 +1178,139 @@ def process_button_clicked(original_excel_file_path, original_excel_data_frame,
     for key, value in respondent_number_dict.items():
         processed_excel_data_frame.loc[key, "No. of Respondents"] = value
 
-    for i in range(len(respondent_objects)):
-        respondent_index = respondent_indexes[i]
-        respondent_object = respondent_objects[i]
+    # Respondent columns are created in the order respondents arrived, so put them back in respondent order
+    processed_excel_data_frame = processed_excel_data_frame[[processed_excel_header for processed_excel_header in processed_excel_headers if processed_excel_header in processed_excel_data_frame.columns]]
 
-        processed_excel_data_frame.loc[respondent_index[0], f"Respondent {respondent_index[1] + 1} Name"] = respondent_object.name
-        processed_excel_data_frame.loc[respondent_index[0], f"Respondent {respondent_index[1] + 1} Address Line 1"] = respondent_object.address_line_1
-        processed_excel_data_frame.loc[respondent_index[0], f"Respondent {respondent_index[1] + 1} Address Line 2"] = respondent_object.address_line_2
-        processed_excel_data_frame.loc[respondent_index[0], f"Respondent {respondent_index[1] + 1} Address Line 3"] = respondent_object.address_line_3
-        processed_excel_data_frame.loc[respondent_index[0], f"Respondent {respondent_index[1] + 1} District"] = respondent_object.district
-        processed_excel_data_frame.loc[respondent_index[0], f"Respondent {respondent_index[1] + 1} State"] = respondent_object.state
-        processed_excel_data_frame.loc[respondent_index[0], f"Respondent {respondent_index[1] + 1} PIN Code"] = respondent_object.pin_code
+    other_headers = get_other_headers(original_excel_data_frame.columns.tolist(), arbitrator_name_header, arbitrator_address_header, arbitrator_phone_header, arbitrator_email_header, respondent_headers)
 
-    other_headers = original_excel_data_frame.columns.tolist()
+    processed_excel_data_frame = pd.concat([processed_excel_data_frame, original_excel_data_frame[other_headers]], axis=1)
 
-    if arbitrator_name_header != "" and arbitrator_name_header in other_headers:
-        other_headers.remove(arbitrator_name_header)
+    processed_excel_data_frame.fillna("", inplace=True)
 
-    if arbitrator_address_header != "" and arbitrator_address_header in other_headers:
-        other_headers.remove(arbitrator_address_header)
+    processed_excel_data_frame["No. of Respondents"] = pd.to_numeric(processed_excel_data_frame["No. of Respondents"], "coerce")
+    processed_excel_data_frame["No. of Respondents"] = processed_excel_data_frame["No. of Respondents"].fillna(0)
 
-    if arbitrator_phone_header != "" and arbitrator_phone_header in other_headers:
-        other_headers.remove(arbitrator_phone_header)
+    return processed_excel_data_frame, (len(reused_row_indexes), reprocessed_row_count)
 
-    if arbitrator_email_header != "" and arbitrator_email_header in other_headers:
-        other_headers.remove(arbitrator_email_header)
 
-    for i in range(respondent_count):
-        name_header = name_headers[i]
-        address_header_count = address_header_counts[i]
-        address_headers = address_header_groups[i * MAX_ADDRESS_HEADER_COUNT:i * MAX_ADDRESS_HEADER_COUNT + address_header_count]
+def process_excel_file_chunked(original_excel_file_path, original_excel_sheet_name, arbitrator_name_header, arbitrator_address_header, arbitrator_phone_header, arbitrator_email_header, respondent_headers):
+    processed_excel_headers = None
+    sort_by_indexes = None
 
-        if name_header in other_headers:
-            other_headers.remove(name_header)
+    reused_row_count = 0
+    reprocessed_row_count = 0
 
-        for address_header in address_headers:
-            if address_header in other_headers:
-                other_headers.remove(address_header)
+    cache_state = open_cache(original_excel_file_path, original_excel_sheet_name)
 
-    processed_excel_data_frame = pd.concat([processed_excel_data_frame, original_excel_data_frame[other_headers]], axis=1)
+    with tempfile.TemporaryDirectory() as run_directory_path:
+        run_file_paths = []
 
-    processed_excel_data_frame.fillna("", inplace=True)
+        # Sort every chunk into its own run file, then merge the runs while writing the processed Excel file
+        for chunk_index, original_excel_data_frame in enumerate(read_excel_chunks(original_excel_file_path, original_excel_sheet_name)):
+            if len(original_excel_data_frame) == 0:
+                continue
 
-    processed_excel_data_frame["No. of Respondents"] = pd.to_numeric(processed_excel_data_frame["No. of Respondents"], "coerce")
-    processed_excel_data_frame["No. of Respondents"].fillna(0, inplace=True)
+            logging.info(f"processing chunk {chunk_index + 1} (rows {original_excel_data_frame.index[0] + 1} to {original_excel_data_frame.index[-1] + 1})")
+
+            processed_excel_data_frame, row_counts = yield from process_data_frame(original_excel_data_frame, arbitrator_name_header, arbitrator_address_header, arbitrator_phone_header, arbitrator_email_header, respondent_headers, cache_state)
+
+            reused_row_count += row_counts[0]
+            reprocessed_row_count += row_counts[1]
+
+            if processed_excel_headers is None:
+                processed_excel_headers = get_processed_excel_headers(original_excel_data_frame.columns.tolist(), arbitrator_name_header, arbitrator_address_header, arbitrator_phone_header, arbitrator_email_header, respondent_headers)
+
+                sort_by_indexes = []
+
+                if arbitrator_name_header != "":
+                    sort_by_indexes.append(processed_excel_headers.index("Arbitrator Name"))
+
+                sort_by_indexes.append(processed_excel_headers.index("No. of Respondents"))
+
+            processed_excel_data_frame = processed_excel_data_frame.reindex(columns=processed_excel_headers, fill_value="")
+
+            processed_rows = processed_excel_data_frame.astype(object).values.tolist()
+            processed_rows.sort(key=lambda x: [x[i] for i in sort_by_indexes])
+
+            run_file_path = os.path.join(run_directory_path, f"{chunk_index}.pickle")
+
+            with open(run_file_path, "wb") as run_file:
+                for processed_row in processed_rows:
+                    pickle.dump(processed_row, run_file)
+
+            run_file_paths.append(run_file_path)
+
+        close_cache(cache_state)
+
+        logging.info(f"rows: {reused_row_count} reused, {reprocessed_row_count} reprocessed")
+
+        gr.Info(f"Rows: {reused_row_count} reused, {reprocessed_row_count} reprocessed")
+
+        if processed_excel_headers is None:
+            yield [None, None]
+
+            return
+
+        processed_excel_file_path = original_excel_file_path.name.replace(".xlsx", " - Processed.xlsx")
+
+        workbook = openpyxl.Workbook(write_only=True)
+        worksheet = workbook.create_sheet("Sheet1")
+        worksheet.append(processed_excel_headers)
+
+        preview_rows = []
+
+        run_files = [open(run_file_path, "rb") for run_file_path in run_file_paths]
+
+        try:
+            for processed_row in heapq.merge(*[read_run_file(run_file) for run_file in run_files], key=lambda x: [x[i] for i in sort_by_indexes]):
+                worksheet.append(processed_row)
+
+                if len(preview_rows) < EXCEL_PREVIEW_ROW_COUNT:
+                    preview_rows.append(processed_row)
+        finally:
+            for run_file in run_files:
+                run_file.close()
+
+        workbook.save(processed_excel_file_path)
+
+    processed_excel_data_frame = pd.DataFrame(preview_rows, columns=processed_excel_headers)
+
+    download_button = gr.DownloadButton(
+        value=processed_excel_file_path
+    )
+
+    yield [processed_excel_data_frame, download_button]
+
+
+def process_button_clicked(original_excel_file_path, original_excel_sheet_name, original_excel_data_frame, arbitrator_name_header, arbitrator_address_header, arbitrator_phone_header, arbitrator_email_header, respondent_count, *inputs):
+    if original_excel_file_path is None or original_excel_data_frame is None or respondent_count is None:
+        yield [None, None]
+
+        return
+
+    respondent_headers = get_respondent_headers(respondent_count, inputs)
+
+    if EXCEL_CHUNKED_MODE:
+        if original_excel_file_path.name.lower().endswith(".xlsx"):
+            yield from process_excel_file_chunked(original_excel_file_path, original_excel_sheet_name, arbitrator_name_header, arbitrator_address_header, arbitrator_phone_header, arbitrator_email_header, respondent_headers)
+
+            return
+
+        # Only .xlsx files can be read in chunks, so read the whole sheet instead of the preview
+        excel_file = pd.ExcelFile(original_excel_file_path)
+
+        original_excel_data_frame = excel_file.parse(original_excel_sheet_name)
+        original_excel_data_frame = original_excel_data_frame.map(lambda x: str_trim_and_none(x))
+        original_excel_data_frame.dropna(how="all", inplace=True)
+        original_excel_data_frame.fillna("", inplace=True)
+
+    cache_state = open_cache(original_excel_file_path, original_excel_sheet_name)
+
+    processed_excel_data_frame, row_counts = yield from process_data_frame(original_excel_data_frame, arbitrator_name_header, arbitrator_address_header, arbitrator_phone_header, arbitrator_email_header, respondent_headers, cache_state)
+
+    close_cache(cache_state)
+
+    gr.Info(f"Rows: {row_counts[0]} reused, {row_counts[1]} reprocessed")
 
     sort_by_headers = []
 
@@ -414,7 +1329,7 @@ def process_button_clicked(original_excel_file_path, original_excel_data_frame,
         value=processed_excel_file_path
     )
 
-    return [processed_excel_data_frame, download_button]
+    yield [processed_excel_data_frame, download_button]
 
 
 def test_button_clicked():
@@ -703,6 +1618,7 @@ with gr.Blocks(title="CNICA ArbeX") as app:
         fn=process_button_clicked,
         inputs=[
             original_excel_file,
+            original_excel_sheet_name_dropdown,
             original_excel_data_frame,
             arbitrator_name_header_dropdown,
             arbitrator_address_header_dropdown,
@@ -742,8 +1658,9 @@ with gr.Blocks(title="CNICA ArbeX") as app:
             ]
         )
 
-app.launch(
-    theme=gr.themes.Default(
-        primary_hue=gr.themes.colors.blue
+if __name__ == "__main__":
+    app.launch(
+        theme=gr.themes.Default(
+            primary_hue=gr.themes.colors.blue
+        )
     )
-)
@@ -0,0 +1,155 @@
+import logging
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import tracemalloc
+
+from types import SimpleNamespace
+
+import openpyxl
+import pandas as pd
+
+import app
+
+BENCHMARK_BATCH_COUNT = 1000
+BENCHMARK_RUN_COUNT = 3
+BENCHMARK_ROW_COUNTS = [10000, 50000, 200000]
+BENCHMARK_WHOLE_SHEET_MAX_ROW_COUNT = 50000
+
+
+def benchmark_gemini_hedging():
+    app.GEMINI_FAKE_BACKEND = True
+    app.GEMINI_REQUEST_TIMEOUT = 12
+    app.GEMINI_FAKE_LATENCY_RANGE = (0.2, 0.6)
+    app.GEMINI_FAKE_STALL_LATENCY = 6
+
+    gemini_batches = []
+
+    for i in range(BENCHMARK_BATCH_COUNT):
+        gemini_batch = []
+
+        for j in range(app.GEMINI_MAX_RESPONDENT_COUNT):
+            gemini_batch.append(f"Respondent {i}-{j}, Address {i}-{j}")
+
+        gemini_batches.append(gemini_batch)
+
+    for hedge_enabled in [False, True]:
+        app.GEMINI_HEDGE_ENABLED = hedge_enabled
+
+        run_percentiles = []
+
+        # Threaded runs cannot be made repeatable with a seed, so every mode is run several times and the spread is reported
+        for run_index in range(BENCHMARK_RUN_COUNT):
+            # Start each run with an empty latency window so that one run does not set the next one's hedge threshold
+            app.gemini_request_latencies.clear()
+
+            batch_latencies = []
+
+            app.gemini_process_batches(gemini_batches, batch_latencies)
+
+            run_percentiles.append([app.get_percentile(batch_latencies, percentile) for percentile in [50, 95, 99, 100]])
+
+            logging.info(f"hedging {'enabled' if hedge_enabled else 'disabled'}, run {run_index + 1}: p50 {run_percentiles[-1][0]:.2f}s, p95 {run_percentiles[-1][1]:.2f}s, p99 {run_percentiles[-1][2]:.2f}s, max {run_percentiles[-1][3]:.2f}s")
+
+        percentile_ranges = [f"{min(percentiles):.2f}-{max(percentiles):.2f}s" for percentiles in zip(*run_percentiles)]
+
+        logging.info(f"hedging {'enabled' if hedge_enabled else 'disabled'} over {BENCHMARK_RUN_COUNT} runs: p50 {percentile_ranges[0]}, p95 {percentile_ranges[1]}, p99 {percentile_ranges[2]}, max {percentile_ranges[3]}")
+
+
+def write_benchmark_excel_file(excel_file_path, row_count):
+    workbook = openpyxl.Workbook(write_only=True)
+    worksheet = workbook.create_sheet("Sheet1")
+    worksheet.append(["ARB NAME", "APPLICANT NAME", "APPLICANT ADDRESS", "APPLICANT CITY", "LOAN NO."])
+
+    for i in range(row_count):
+        worksheet.append([f"Arbitrator {i % 7}", f"Applicant {i}", f"{i} Main Road", f"City {i % 100}", f"LN{i:08d}"])
+
+    workbook.save(excel_file_path)
+
+
+def get_peak_resident_memory():
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+
+
+def measure_processing_memory(excel_file_path, cache_directory_path, excel_chunked_mode, trace_memory):
+    app.GEMINI_FAKE_BACKEND = True
+    app.GEMINI_FAKE_LATENCY_RANGE = (0, 0)
+    app.GEMINI_FAKE_STALL_PROBABILITY = 0
+    app.GEMINI_FAKE_TRUNCATION_PROBABILITY = 0
+    app.CACHE_DIRECTORY_PATH = cache_directory_path
+    app.EXCEL_CHUNKED_MODE = excel_chunked_mode
+
+    name_headers = ["APPLICANT NAME"] + [""] * (app.MAX_RESPONDENT_COUNT - 1)
+    address_header_counts = [2] + [1] * (app.MAX_RESPONDENT_COUNT - 1)
+    address_headers = ["APPLICANT ADDRESS", "APPLICANT CITY"] + [""] * (app.MAX_RESPONDENT_COUNT * app.MAX_ADDRESS_HEADER_COUNT - 2)
+
+    # tracemalloc adds its own overhead to the resident set, so the two are measured in separate runs
+    if trace_memory:
+        tracemalloc.start()
+
+    start_memory = get_peak_resident_memory()
+
+    # The whole sheet mode processes the data frame shown in the UI, so it is loaded inside the measurement
+    original_excel_data_frame = pd.read_excel(excel_file_path, nrows=app.EXCEL_PREVIEW_ROW_COUNT if excel_chunked_mode else None)
+    original_excel_data_frame = original_excel_data_frame.map(lambda x: app.str_trim_and_none(x))
+    original_excel_data_frame.dropna(how="all", inplace=True)
+    original_excel_data_frame.fillna("", inplace=True)
+
+    for _ in app.process_button_clicked(SimpleNamespace(name=excel_file_path), "Sheet1", original_excel_data_frame, "ARB NAME", "", "", "", 1, *name_headers, *address_header_counts, *address_headers):
+        pass
+
+    # Remove the cache so that every run processes all rows
+    os.remove(app.get_cache_file_path(SimpleNamespace(name=excel_file_path)))
+
+    if trace_memory:
+        _, peak_memory = tracemalloc.get_traced_memory()
+
+        tracemalloc.stop()
+
+        return peak_memory
+
+    return get_peak_resident_memory() - start_memory
+
+
+def benchmark_chunked_memory():
+    # ru_maxrss only ever grows, so every measurement runs in a new process that starts from the same resident set
+    multiprocessing_context = multiprocessing.get_context("spawn")
+
+    chunked_resident_memories = []
+
+    with tempfile.TemporaryDirectory() as benchmark_directory_path:
+        cache_directory_path = os.path.join(benchmark_directory_path, "cache")
+
+        for row_count in BENCHMARK_ROW_COUNTS:
+            excel_file_path = os.path.join(benchmark_directory_path, f"Benchmark {row_count}.xlsx")
+
+            write_benchmark_excel_file(excel_file_path, row_count)
+
+            for excel_chunked_mode in [False, True]:
+                # The whole sheet mode writes every respondent into one data frame and takes too long on the largest sheets
+                if not excel_chunked_mode and row_count > BENCHMARK_WHOLE_SHEET_MAX_ROW_COUNT:
+                    continue
+
+                with multiprocessing_context.Pool(1) as pool:
+                    peak_memory = pool.apply(measure_processing_memory, (excel_file_path, cache_directory_path, excel_chunked_mode, True))
+
+                with multiprocessing_context.Pool(1) as pool:
+                    resident_memory = pool.apply(measure_processing_memory, (excel_file_path, cache_directory_path, excel_chunked_mode, False))
+
+                if excel_chunked_mode:
+                    chunked_resident_memories.append(resident_memory)
+
+                logging.info(f"{'chunked' if excel_chunked_mode else 'whole sheet'} mode, {row_count} rows: peak traced memory {peak_memory / 1024 / 1024:.1f} MiB, peak resident memory {resident_memory / 1024 / 1024:.1f} MiB above the start")
+
+    # tracemalloc does not see the buffers of the C parsers, so the growth is taken from the resident memory
+    row_count_growth = BENCHMARK_ROW_COUNTS[-1] - BENCHMARK_ROW_COUNTS[0]
+
+    logging.info(f"chunked mode: peak resident memory grows by about {(chunked_resident_memories[-1] - chunked_resident_memories[0]) / row_count_growth:.0f} B per row from {BENCHMARK_ROW_COUNTS[0]} to {BENCHMARK_ROW_COUNTS[-1]} rows")
+
+
+if __name__ == "__main__":
+    benchmark_gemini_hedging()
+    benchmark_chunked_memory()